@@ -1,4 +1,6 @@
+import os
 import streamlit as st
+import numpy as np
 import pandas as pd
 import plotly.express as px
 import plotly.graph_objects as go
@@ -11,114 +13,285 @@ st.set_page_config(
     page_icon=":bar_chart:"
 )
 
-# ----- LOAD EXTERNAL FONTAWESOME FOR ICONS -----
-st.markdown(
-    """
-    <link rel="stylesheet" 
-          href="https://use.fontawesome.com/releases/v5.15.4/css/all.css" 
-          integrity="sha384-DyZ88mC6kzNeFjsV12o4F2X0p7mUp72mmfj/wzLA16pJo1sw8a4z9ShS4rA6m1wR" 
-          crossorigin="anonymous">
-    """,
-    unsafe_allow_html=True
-)
+# ----- KPI ICONS -----
+ICON_MAP = {
+    "Sales": ":moneybag:",
+    "Quantity Sold": ":package:",
+    "Profit": ":dollar:",
+    "Margin Rate": ":chart_with_upwards_trend:",
+    "Avg Discount": ":label:",
+}
 
 # ----- CUSTOM CSS -----
-st.markdown(
-    """
-    <style>
-    /* Hide Streamlit default elements for a cleaner look */
-    #MainMenu {visibility: hidden;}
-    footer {visibility: hidden;}
-    header {visibility: hidden;}
-
-    /* Custom scrollbar styling */
-    ::-webkit-scrollbar {
-        width: 8px;
-    }
-    ::-webkit-scrollbar-track {
-        background: #ccc;
-    }
-    ::-webkit-scrollbar-thumb {
-        background: #888;
-    }
+@st.cache_resource
+def load_css():
+    with open("static/style.css") as f:
+        return f"<style>{f.read()}</style>"
 
-    /* KPI box styling */
-    .kpi-box {
-        background-color: rgba(255, 255, 255, 0.05);
-        border: 1px solid #444;
-        border-radius: 8px;
-        padding: 16px;
-        margin: 8px;
-        text-align: center;
-        box-shadow: 0 2px 4px rgba(0,0,0,0.2);
-        transition: transform 0.3s ease-in-out;
-    }
-    .kpi-box:hover {
-        transform: scale(1.05);
-    }
-    .kpi-title {
-        font-weight: 600;
-        color: #FFFFFF;
-        font-size: 16px;
-        margin-bottom: 8px;
-    }
-    .kpi-value {
-        font-weight: 700;
-        font-size: 24px;
-        color: #1E90FF;
-    }
-    .icon {
-        font-size: 24px;
-        margin-right: 8px;
-        color: #1E90FF;
-    }
-    /* Tooltip styling */
-    .tooltip-text {
-        visibility: hidden;
-        width: 220px;
-        background-color: #333;
-        color: #fff;
-        text-align: center;
-        border-radius: 6px;
-        padding: 8px;
-        position: absolute;
-        z-index: 1;
-        bottom: 110%;
-        left: 50%;
-        margin-left: -110px;
-        opacity: 0;
-        transition: opacity 0.3s;
-        font-size: 14px;
-    }
-    .tooltip-text::after {
-        content: "";
-        position: absolute;
-        top: 100%;
-        left: 50%;
-        margin-left: -5px;
-        border-width: 5px;
-        border-style: solid;
-        border-color: #333 transparent transparent transparent;
-    }
-    .kpi-box:hover .tooltip-text {
-        visibility: visible;
-        opacity: 1;
-    }
-    </style>
-    """,
-    unsafe_allow_html=True
-)
+# Streamlit drops elements that a rerun doesn't emit, so the styles are sent every run as one element
+st.markdown(load_css(), unsafe_allow_html=True)
 
 # ----- LOAD DATA WITH CACHING -----
-@st.cache_data
+EXCEL_PATH = "Sample - Superstore.xlsx"
+# Bump the version whenever the conversions in load_data change so stale copies are ignored
+PARQUET_VERSION = 1
+PARQUET_PATH = f"superstore.v{PARQUET_VERSION}.parquet"
+CATEGORY_COLUMNS = ["Region", "State", "City", "Country", "Category", "Sub-Category", "Product Name", "Segment", "Ship Mode"]
+DATE_COLUMNS = ["Order Date", "Ship Date"]
+FLOAT32_COLUMNS = ["Sales", "Profit", "Discount"]
+INT32_COLUMNS = ["Quantity"]
+
+@st.cache_resource
 def load_data():
-    df = pd.read_excel("Sample - Superstore.xlsx",engine="openpyxl")
-    # Convert "Order Date" to datetime if needed
-    if not pd.api.types.is_datetime64_any_dtype(df["Order Date"]):
-        df["Order Date"] = pd.to_datetime(df["Order Date"])
+    # Reuse the Parquet copy unless the XLSX is newer; parsing the XLSX is the slowest part of a cold start
+    if os.path.exists(PARQUET_PATH) and os.path.getmtime(PARQUET_PATH) >= os.path.getmtime(EXCEL_PATH):
+        return pd.read_parquet(PARQUET_PATH)
+
+    df = pd.read_excel(EXCEL_PATH, engine="openpyxl")
+    for col in CATEGORY_COLUMNS:
+        df[col] = df[col].astype("category")
+    for col in DATE_COLUMNS:
+        df[col] = pd.to_datetime(df[col], cache=True)
+    # Narrow numeric dtypes halve the bytes touched by every groupby, resample and chart
+    for col in FLOAT32_COLUMNS:
+        df[col] = df[col].astype("float32")
+    for col in INT32_COLUMNS:
+        df[col] = df[col].astype("int32")
+    for col in ["Row ID", "Postal Code"]:
+        df[col] = pd.to_numeric(df[col], downcast="integer")
+    # Sort once here; boolean-mask filtering keeps this order for the resampling below
+    df = df.sort_values("Order Date", kind="mergesort").reset_index(drop=True)
+    # Write to a temp file first so an interrupted write never leaves a corrupt copy behind.
+    # The copy is only a speed-up, so a read-only deploy directory just skips it
+    tmp_path = f"{PARQUET_PATH}.{os.getpid()}.tmp"
+    try:
+        df.to_parquet(tmp_path, compression="zstd")
+        os.replace(tmp_path, PARQUET_PATH)
+    except OSError:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
     return df
 
+@st.cache_data
+def get_filter_options(_df):
+    # Sidebar options only depend on the shared source frame, so compute them once without hashing it
+    region_states = _df.groupby(["Region", "State"], observed=True).groups.keys()
+    category_subcats = _df.groupby(["Category", "Sub-Category"], observed=True).groups.keys()
+    state_by_region = {}
+    for region, state in region_states:
+        state_by_region.setdefault(region, []).append(state)
+    subcat_by_category = {}
+    for category, subcat in category_subcats:
+        subcat_by_category.setdefault(category, []).append(subcat)
+    return {
+        "region": sorted(state_by_region),
+        "state_by_region": {k: sorted(v) for k, v in state_by_region.items()},
+        "category": sorted(subcat_by_category),
+        "subcat_by_category": {k: sorted(v) for k, v in subcat_by_category.items()},
+        "date_min": _df["Order Date"].min(),
+        "date_max": _df["Order Date"].max(),
+    }
+
+# ----- CACHED AGGREGATIONS -----
+AGG_FUNCS = {
+    "Sales": "sum",
+    "Quantity": "sum",
+    "Profit": "sum",
+    "Discount": "mean"
+}
+METRIC_COLUMNS = list(AGG_FUNCS)
+# Caches keyed on the active filters get one entry per filter combination, so bound them
+FILTER_CACHE_ENTRIES = 32
+
+def sum_by_category(df, key, value):
+    # Weighted bincount over the category codes; cheaper than a groupby for a handful of groups
+    categories = df[key].cat.categories
+    codes = df[key].cat.codes.to_numpy()
+    valid = codes >= 0
+    codes = codes[valid]
+    sums = np.bincount(codes, weights=df[value].to_numpy()[valid], minlength=len(categories))
+    observed = np.bincount(codes, minlength=len(categories)) > 0
+    return pd.DataFrame({key: categories[observed], value: sums[observed]})
+
+# The leading underscore keeps Streamlit from hashing the frame; filter_key identifies it instead
+# Each groupby only sees the columns it aggregates, not the full ~20-column frame
+@st.cache_data(max_entries=FILTER_CACHE_ENTRIES)
+def aggregate_all(filter_key, _df):
+    product_grouped = (
+        _df[["Product Name"] + METRIC_COLUMNS]
+        .groupby("Product Name", as_index=False, observed=True, sort=False)
+        .agg(AGG_FUNCS)
+    )
+    product_grouped["Margin Rate"] = product_grouped["Profit"] / product_grouped["Sales"].replace(0, 1)
+    product_grouped["Avg Discount"] = product_grouped["Discount"]
+    return {
+        "product": product_grouped,
+        "region": sum_by_category(_df, "Region", "Sales"),
+        "category_profit": sum_by_category(_df, "Category", "Profit").sort_values(by="Profit", ascending=False),
+        "subcat_sales": sum_by_category(_df, "Sub-Category", "Sales"),
+    }
+
+RESAMPLE_RULES = {"Daily": "D", "Weekly": "W", "Monthly": "ME"}
+ROLLING_WINDOWS = {"Daily": 30, "Weekly": 4, "Monthly": 3}
+
+@st.cache_data(max_entries=FILTER_CACHE_ENTRIES)
+def resample_frame(filter_key, _df, level):
+    return (
+        _df[["Order Date"] + METRIC_COLUMNS]
+        .set_index("Order Date")
+        .resample(RESAMPLE_RULES[level])
+        .agg(AGG_FUNCS)
+        .reset_index()
+    )
+
+# Download payloads are only serialized when the button is clicked (callable data=)
+def to_csv_bytes(df):
+    return df.to_csv(index=False).encode("utf-8")
+
+def to_parquet_bytes(df):
+    return df.to_parquet(index=False)
+
+MAX_SCATTER_POINTS = 5000
+
+# ----- CACHED FIGURES -----
+# Figures are memoized on the filters and the controlling widgets, so reruns that don't
+# change them skip building the Plotly figures; the frames are excluded from hashing.
+# cache_resource returns the same object on a hit instead of unpickling and revalidating
+# it, which is safe because the figures are never modified after they are returned
+@st.cache_resource(max_entries=FILTER_CACHE_ENTRIES)
+def build_kpi_figures(filter_key, agg_level, selected_kpi, plotly_template, _df_agg, _product_grouped):
+    rolling_window = ROLLING_WINDOWS[agg_level]
+    rolling_avg = _df_agg[selected_kpi].rolling(window=rolling_window).mean()
+
+    # --- 1. Time Series Area Chart with Rolling Average ---
+    fig_area = px.area(
+        _df_agg,
+        x="Order Date",
+        y=selected_kpi,
+        title=f"{selected_kpi} Over Time ({agg_level} Aggregation)",
+        template=plotly_template,
+        color_discrete_sequence=["#1E90FF"]
+    )
+    fig_area.add_scatter(
+        x=_df_agg["Order Date"],
+        y=rolling_avg,
+        mode="lines+markers",
+        name=f"{rolling_window} Period Rolling Avg",
+        line=dict(color="orange")
+    )
+    fig_area.update_layout(
+        hovermode="x unified",
+        legend=dict(yanchor="bottom", y=1.02, xanchor="right", x=1)
+    )
+
+    # --- 2. Top 10 Products Chart ---
+    top_10 = _product_grouped.nlargest(10, selected_kpi)
+
+    fig_bar = px.bar(
+        top_10,
+        x=selected_kpi,
+        y="Product Name",
+        orientation="h",
+        title=f"Top 10 Products by {selected_kpi}",
+        template=plotly_template,
+        color=selected_kpi,
+        color_continuous_scale="Blues"
+    )
+    fig_bar.update_layout(yaxis={"categoryorder": "total ascending"})
+    return fig_area, fig_bar
+
+@st.cache_resource(max_entries=FILTER_CACHE_ENTRIES)
+def build_insight_figures(filter_key, plotly_template, _aggregates, _df_monthly, _df):
+    # --- 3. Sales by Region as a Donut Chart ---
+    fig_region = px.pie(
+        _aggregates["region"],
+        names="Region",
+        values="Sales",
+        title="Sales by Region",
+        template=plotly_template,
+        hole=0.4,
+        color_discrete_sequence=px.colors.qualitative.Pastel
+    )
+    fig_region.update_traces(textposition='inside', textinfo='percent+label')
+
+    # Sales & Profit Over Time: Dual-line chart using the aggregated data (using monthly for smoother trends)
+    fig_sales_profit = px.line(
+        _df_monthly,
+        x="Order Date",
+        y=["Sales", "Profit"],
+        title="Sales and Profit Over Time (Monthly)",
+        template=plotly_template
+    )
+    fig_sales_profit.update_layout(hovermode="x unified")
+
+    # Profit by Category
+    fig_profit_category = px.bar(
+        _aggregates["category_profit"],
+        x="Category",
+        y="Profit",
+        title="Profit by Category",
+        template=plotly_template,
+        color="Profit",
+        color_continuous_scale="Blues"
+    )
+
+    # Discount vs Profit Margin
+    df_margin = _df[["Discount", "Sales", "Profit", "Category"]]
+    df_margin = df_margin.assign(**{"Profit Margin": (df_margin["Profit"] / df_margin["Sales"].replace(0, np.nan)).fillna(0)})
+    # Cap the marker count with a per-Category sample to keep the browser responsive
+    if len(df_margin) > MAX_SCATTER_POINTS:
+        df_margin = df_margin.groupby("Category", observed=True, group_keys=False).sample(
+            frac=MAX_SCATTER_POINTS / len(df_margin), random_state=0
+        )
+    fig_discount_profit = px.scatter(
+        df_margin,
+        x="Discount",
+        y="Profit Margin",
+        color="Category",
+        title="Discount vs Profit Margin",
+        template=plotly_template,
+        hover_data=["Sales", "Profit"],
+        render_mode="webgl"
+    )
+
+    # Sales Distribution by Sub-Category: Treemap
+    fig_treemap = px.treemap(
+        _aggregates["subcat_sales"],
+        path=['Sub-Category'],
+        values="Sales",
+        title="Sales Distribution by Sub-Category",
+        template=plotly_template,
+        color="Sales",
+        color_continuous_scale="Blues"
+    )
+    return {
+        "region": fig_region,
+        "sales_profit": fig_sales_profit,
+        "profit_category": fig_profit_category,
+        "discount_profit": fig_discount_profit,
+        "treemap": fig_treemap,
+    }
+
+# ----- KPI CHART FRAGMENT -----
+# Changing the KPI radio only reruns this fragment, not filtering and aggregation
+@st.fragment
+def render_kpi_charts(filter_key, df_agg, product_grouped, agg_level, plotly_template):
+    # KPI for chart selection
+    kpi_options = ["Sales", "Quantity", "Profit", "Margin Rate", "Avg Discount"]
+    selected_kpi = st.radio("Select KPI for Time Series & Product Analysis:", options=kpi_options, horizontal=True)
+
+    fig_area, fig_bar = build_kpi_figures(
+        filter_key, agg_level, selected_kpi, plotly_template, df_agg, product_grouped
+    )
+
+    col_left, col_right = st.columns(2)
+    with col_left:
+        st.plotly_chart(fig_area, use_container_width=True)
+    with col_right:
+        st.plotly_chart(fig_bar, use_container_width=True)
+
 df_original = load_data()
+filter_options = get_filter_options(df_original)
 
 # ----- PAGE TITLE -----
 st.markdown("<h1 style='text-align: center; color: #1E90FF;'>SuperStore KPI Dashboard</h1>", unsafe_allow_html=True)
@@ -134,32 +307,41 @@ plotly_template = "plotly_dark" if theme_choice == "Dark" else "plotly_white"
 agg_level = st.sidebar.radio("Aggregation Level", ["Daily", "Weekly", "Monthly"], index=2)
 
 # Region Filter
-all_regions = sorted(df_original["Region"].dropna().unique())
+mask = np.ones(len(df_original), dtype=bool)
+all_regions = filter_options["region"]
 selected_regions = st.sidebar.multiselect("Region(s)", options=all_regions, default=all_regions)
-df_filtered = df_original[df_original["Region"].isin(selected_regions)] if selected_regions else df_original
+if selected_regions:
+    mask &= df_original["Region"].isin(selected_regions).to_numpy()
 
 # State Filter
-all_states = sorted(df_filtered["State"].dropna().unique())
+all_states = sorted({
+    state
+    for region in (selected_regions or all_regions)
+    for state in filter_options["state_by_region"][region]
+})
 selected_states = st.sidebar.multiselect("State(s)", options=all_states, default=all_states)
-df_filtered = df_filtered[df_filtered["State"].isin(selected_states)] if selected_states else df_filtered
+if selected_states:
+    mask &= df_original["State"].isin(selected_states).to_numpy()
 
 # Category Filter
-all_categories = sorted(df_filtered["Category"].dropna().unique())
+all_categories = filter_options["category"]
 selected_categories = st.sidebar.multiselect("Category(ies)", options=all_categories, default=all_categories)
-df_filtered = df_filtered[df_filtered["Category"].isin(selected_categories)] if selected_categories else df_filtered
+if selected_categories:
+    mask &= df_original["Category"].isin(selected_categories).to_numpy()
 
 # Sub-Category Filter
-all_subcategories = sorted(df_filtered["Sub-Category"].dropna().unique())
+all_subcategories = sorted({
+    subcat
+    for category in (selected_categories or all_categories)
+    for subcat in filter_options["subcat_by_category"][category]
+})
 selected_subcategories = st.sidebar.multiselect("Sub-Category(ies)", options=all_subcategories, default=all_subcategories)
-df_filtered = df_filtered[df_filtered["Sub-Category"].isin(selected_subcategories)] if selected_subcategories else df_filtered
+if selected_subcategories:
+    mask &= df_original["Sub-Category"].isin(selected_subcategories).to_numpy()
 
 # Date Range Filter
-if not df_filtered.empty:
-    min_date = df_filtered["Order Date"].min()
-    max_date = df_filtered["Order Date"].max()
-else:
-    min_date = df_original["Order Date"].min()
-    max_date = df_original["Order Date"].max()
+min_date = filter_options["date_min"]
+max_date = filter_options["date_max"]
 
 st.sidebar.subheader("Date Range")
 from_date = st.sidebar.date_input("From", value=min_date, min_value=min_date, max_value=max_date)
@@ -168,51 +350,50 @@ to_date = st.sidebar.date_input("To", value=max_date, min_value=min_date, max_va
 if from_date > to_date:
     st.sidebar.error("From Date must be earlier than To Date.")
 
-df = df_filtered[
-    (df_filtered["Order Date"] >= pd.to_datetime(from_date)) &
-    (df_filtered["Order Date"] <= pd.to_datetime(to_date))
-].copy()
+# Compare dates as int64 nanoseconds so the whole filter stays a single boolean mask
+order_dates = df_original["Order Date"].to_numpy(dtype="datetime64[ns]").view("i8")
+from_ts = pd.Timestamp(from_date).value
+to_ts = pd.Timestamp(to_date).value
+mask &= (order_dates >= from_ts) & (order_dates <= to_ts)
+
+df = df_original.iloc[mask]
+filter_key = (
+    tuple(selected_regions),
+    tuple(selected_states),
+    tuple(selected_categories),
+    tuple(selected_subcategories),
+    from_ts,
+    to_ts,
+)
 
 # ----- KPI CALCULATIONS -----
 if df.empty:
     total_sales = total_quantity = total_profit = margin_rate = avg_discount = 0
 else:
-    total_sales = df["Sales"].sum()
+    # The columns are stored as float32; accumulate in float64 so the dollar totals keep their cents
+    total_sales = df["Sales"].to_numpy().sum(dtype=np.float64)
     total_quantity = df["Quantity"].sum()
-    total_profit = df["Profit"].sum()
+    total_profit = df["Profit"].to_numpy().sum(dtype=np.float64)
     margin_rate = total_profit / total_sales if total_sales else 0
-    avg_discount = df["Discount"].mean() if "Discount" in df.columns else 0
+    avg_discount = df["Discount"].to_numpy().mean(dtype=np.float64)
 
 # Determine color for margin rate KPI (red if below 15% target)
 margin_color = "#FF4B4B" if margin_rate < 0.15 else "#1E90FF"
 
 # ----- KPI DISPLAY -----
 kpi_cols = st.columns(5)
+# The Margin Rate delta is measured against the 15% target, so falling below it shows in red
 kpi_data = [
-    ("Sales", f"${total_sales:,.2f}", "Total revenue generated."),
-    ("Quantity Sold", f"{total_quantity:,.0f}", "Total units sold."),
-    ("Profit", f"${total_profit:,.2f}", "Net profit after costs."),
-    ("Margin Rate", f"{(margin_rate * 100):.2f}%", "Profit margin percentage.", margin_color),
-    ("Avg Discount", f"{(avg_discount * 100):.2f}%", "Average discount applied.")
+    ("Sales", f"${total_sales:,.2f}", "Total revenue generated.", None),
+    ("Quantity Sold", f"{total_quantity:,.0f}", "Total units sold.", None),
+    ("Profit", f"${total_profit:,.2f}", "Net profit after costs.", None),
+    ("Margin Rate", f"{(margin_rate * 100):.2f}%", "Profit margin percentage.",
+     f"{(margin_rate - 0.15) * 100:+.2f} pts vs target"),
+    ("Avg Discount", f"{(avg_discount * 100):.2f}%", "Average discount applied.", None)
 ]
 
-for i, item in enumerate(kpi_data):
-    title, value, tooltip = item[0], item[1], item[2]
-    extra_style = f"style='color:{item[3]}'" if len(item) > 3 else ""
-    kpi_cols[i].markdown(
-        f"""
-        <div class='kpi-box' title='{tooltip}'>
-            <div class='kpi-title'><i class="icon fa fa-{ 'dollar-sign' if title=='Sales' else 
-                                                       'boxes' if title=='Quantity Sold' else 
-                                                       'money-bill' if title=='Profit' else 
-                                                       'percent' if title=='Margin Rate' else 
-                                                       'tag' }"></i>{title}</div>
-            <div class='kpi-value' {extra_style}>{value}</div>
-            <span class="tooltip-text">{tooltip}</span>
-        </div>
-        """,
-        unsafe_allow_html=True
-    )
+for col, (title, value, tooltip, delta) in zip(kpi_cols, kpi_data):
+    col.metric(label=f"{ICON_MAP[title]} {title}", value=value, delta=delta, help=tooltip)
 
 # ----- ADD A GAUGE CHART FOR MARGIN RATE -----
 st.markdown("---")
@@ -243,174 +424,54 @@ st.markdown("---")
 if df.empty:
     st.warning("No data available for the selected filters and date range.")
 else:
-    # KPI for chart selection
-    kpi_options = ["Sales", "Quantity", "Profit", "Margin Rate", "Avg Discount"]
-    selected_kpi = st.radio("Select KPI for Time Series & Product Analysis:", options=kpi_options, horizontal=True)
+    aggregates = aggregate_all(filter_key, df)
 
     # --- AGGREGATE DATA BASED ON AGGREGATION LEVEL ---
-    # Create a copy with Order Date as index
-    df_sorted = df.sort_values("Order Date").copy()
-    df_sorted.set_index("Order Date", inplace=True)
-
-    agg_dict = {
-        "Sales": "sum",
-        "Quantity": "sum",
-        "Profit": "sum",
-        "Discount": "mean"
-    }
-
-    if agg_level == "Daily":
-        df_agg = df_sorted.resample("D").agg(agg_dict).reset_index()
-        rolling_window = 30
-    elif agg_level == "Weekly":
-        df_agg = df_sorted.resample("W").agg(agg_dict).reset_index()
-        rolling_window = 4
-    else:  # Monthly
-        df_agg = df_sorted.resample("M").agg(agg_dict).reset_index()
-        rolling_window = 3
+    df_agg = resample_frame(filter_key, df, agg_level)
 
     # Compute additional metrics
     df_agg["Margin Rate"] = df_agg["Profit"] / df_agg["Sales"].replace(0, 1)
     df_agg["Avg Discount"] = df_agg["Discount"]
-    df_agg[f"Rolling_Avg_{selected_kpi}"] = df_agg[selected_kpi].rolling(window=rolling_window).mean()
 
-    # --- 1. Time Series Area Chart with Rolling Average ---
-    fig_area = px.area(
-        df_agg,
-        x="Order Date",
-        y=selected_kpi,
-        title=f"{selected_kpi} Over Time ({agg_level} Aggregation)",
-        template=plotly_template,
-        color_discrete_sequence=["#1E90FF"]
-    )
-    fig_area.add_scatter(
-        x=df_agg["Order Date"],
-        y=df_agg[f"Rolling_Avg_{selected_kpi}"],
-        mode="lines+markers",
-        name=f"{rolling_window} Period Rolling Avg",
-        line=dict(color="orange")
-    )
-    fig_area.update_layout(
-        hovermode="x unified",
-        legend=dict(yanchor="bottom", y=1.02, xanchor="right", x=1)
-    )
+    # --- 1 & 2. Time Series and Top 10 Products (rerun on their own when the KPI changes) ---
+    render_kpi_charts(filter_key, df_agg, aggregates["product"], agg_level, plotly_template)
 
-    # --- 2. Top 10 Products Chart ---
-    product_grouped = df.groupby("Product Name", as_index=False).agg({
-        "Sales": "sum",
-        "Quantity": "sum",
-        "Profit": "sum",
-        "Discount": "mean"
-    })
-    product_grouped["Margin Rate"] = product_grouped["Profit"] / product_grouped["Sales"].replace(0, 1)
-    product_grouped["Avg Discount"] = product_grouped["Discount"]
-    product_grouped.sort_values(by=selected_kpi, ascending=False, inplace=True)
-    top_10 = product_grouped.head(10)
-
-    fig_bar = px.bar(
-        top_10,
-        x=selected_kpi,
-        y="Product Name",
-        orientation="h",
-        title=f"Top 10 Products by {selected_kpi}",
-        template=plotly_template,
-        color=selected_kpi,
-        color_continuous_scale="Blues"
-    )
-    fig_bar.update_layout(yaxis={"categoryorder": "total ascending"})
+    # Sales & Profit Over Time uses the monthly aggregation regardless of the selected level
+    df_monthly = resample_frame(filter_key, df, "Monthly")
+    df_monthly["Margin Rate"] = df_monthly["Profit"] / df_monthly["Sales"].replace(0, 1)
 
-    # --- 3. Sales by Region as a Donut Chart ---
-    region_grouped = df.groupby("Region", as_index=False)["Sales"].sum()
-    fig_region = px.pie(
-        region_grouped,
-        names="Region",
-        values="Sales",
-        title="Sales by Region",
-        template=plotly_template,
-        hole=0.4,
-        color_discrete_sequence=px.colors.qualitative.Pastel
-    )
-    fig_region.update_traces(textposition='inside', textinfo='percent+label')
+    figures = build_insight_figures(filter_key, plotly_template, aggregates, df_monthly, df)
 
     # --- LAYOUT THE CHARTS ---
-    col_left, col_right = st.columns(2)
-    with col_left:
-        st.plotly_chart(fig_area, use_container_width=True)
-    with col_right:
-        st.plotly_chart(fig_bar, use_container_width=True)
-
     col_region, col_download = st.columns(2)
     with col_region:
-        st.plotly_chart(fig_region, use_container_width=True)
+        st.plotly_chart(figures["region"], use_container_width=True)
     with col_download:
         st.markdown("### Download Data")
-        csv_data = df.reset_index(drop=True).to_csv(index=False).encode("utf-8")
         st.download_button(
             label="Download CSV",
-            data=csv_data,
+            data=lambda: to_csv_bytes(df),
             file_name="filtered_superstore_data.csv",
             mime="text/csv"
         )
+        st.download_button(
+            label="Download Parquet",
+            data=lambda: to_parquet_bytes(df),
+            file_name="filtered_superstore_data.parquet",
+            mime="application/vnd.apache.parquet"
+        )
         st.dataframe(df.reset_index(drop=True), height=300, use_container_width=True)
 
     # ----- ADDITIONAL INSIGHTS -----
     st.markdown("## Additional Insights")
-    # Sales & Profit Over Time: Dual-line chart using the aggregated data (using monthly for smoother trends)
-    df_monthly = df_sorted.resample("M").agg(agg_dict).reset_index()
-    df_monthly["Margin Rate"] = df_monthly["Profit"] / df_monthly["Sales"].replace(0, 1)
-    fig_sales_profit = px.line(
-        df_monthly,
-        x="Order Date",
-        y=["Sales", "Profit"],
-        title="Sales and Profit Over Time (Monthly)",
-        template=plotly_template
-    )
-    fig_sales_profit.update_layout(hovermode="x unified")
-
-    # Profit by Category
-    category_profit = df.groupby("Category", as_index=False)["Profit"].sum().sort_values(by="Profit", ascending=False)
-    fig_profit_category = px.bar(
-        category_profit,
-        x="Category",
-        y="Profit",
-        title="Profit by Category",
-        template=plotly_template,
-        color="Profit",
-        color_continuous_scale="Blues"
-    )
-
-    # Discount vs Profit Margin
-    df["Profit Margin"] = df.apply(lambda row: row["Profit"] / row["Sales"] if row["Sales"] != 0 else 0, axis=1)
-    fig_discount_profit = px.scatter(
-        df,
-        x="Discount",
-        y="Profit Margin",
-        color="Category",
-        title="Discount vs Profit Margin",
-        template=plotly_template,
-        hover_data=["Sales", "Profit"]
-    )
-
-    # Sales Distribution by Sub-Category: Treemap
-    subcat_sales = df.groupby("Sub-Category", as_index=False)["Sales"].sum()
-    fig_treemap = px.treemap(
-        subcat_sales,
-        path=['Sub-Category'],
-        values="Sales",
-        title="Sales Distribution by Sub-Category",
-        template=plotly_template,
-        color="Sales",
-        color_continuous_scale="Blues"
-    )
-
     col_insight1, col_insight2 = st.columns(2)
     with col_insight1:
-        st.plotly_chart(fig_sales_profit, use_container_width=True)
+        st.plotly_chart(figures["sales_profit"], use_container_width=True)
     with col_insight2:
-        st.plotly_chart(fig_profit_category, use_container_width=True)
+        st.plotly_chart(figures["profit_category"], use_container_width=True)
 
     col_insight3, col_insight4 = st.columns(2)
     with col_insight3:
-        st.plotly_chart(fig_discount_profit, use_container_width=True)
+        st.plotly_chart(figures["discount_profit"], use_container_width=True)
     with col_insight4:
-        st.plotly_chart(fig_treemap, use_container_width=True)
+        st.plotly_chart(figures["treemap"], use_container_width=True)